@@ -2,7 +2,11 @@ import numpy as np
 import matplotlib.pyplot as plt
 import xml.etree.ElementTree as ET
 import json 
+import sys
 import parse_input_with_bodies
+import validate_design
+import fold_presolver
+import dof_reduction
 
 def plot(vertices):
     plt.scatter(vertices[:, 0], vertices[:, 1])
@@ -16,21 +20,52 @@ def axis_to_string(ax):
     else:
         return "0 0 1"
 
-def get_mjcf_flex(name, vertices, edges, grounds, joints,actuators, rgba="0 0 1 0.9"):
+def add_keyframe(mj, vertices, keyframe_positions, actuators, key_name="folded"):
+    ''' Adds a keyframe that starts the model with its vertices at keyframe_positions. Every slide joint
+    takes the displacement of the body it is attached to along its axis, in the order MuJoCo lays out qpos. 
+    Position actuators are given the same targets so they hold the pose instead of pulling it back flat. '''
+    qpos = []
+    joint_values = {}
+    for body in mj.find("worldbody").findall("body"):
+        i = int(body.get("name")[1:]) - 1
+        moved = set()
+        for joint in body.findall("joint"):
+            axis = [float(a) for a in joint.get("axis").split()].index(1.0)
+            # A second joint along the same axis of one body would double the displacement
+            value = 0.0 if axis in moved else keyframe_positions[i][axis] - vertices[i][axis]
+            moved.add(axis)
+            qpos.append(value)
+            joint_values[joint.get("name")] = value
+    keyframe = ET.SubElement(mj, "keyframe")
+    key = ET.SubElement(keyframe, "key", name=key_name, qpos=" ".join(f"{q:.6g}" for q in qpos))
+    if actuators:
+        ctrl = []
+        for act in mj.find("actuator").findall("position"):
+            low, high = (float(c) for c in act.get("ctrlrange").split())
+            ctrl.append(min(high, max(low, joint_values.get(act.get("joint"), 0.0))))
+        key.set("ctrl", " ".join(f"{c:.6g}" for c in ctrl))
+
+def get_mjcf_flex(name, vertices, edges, grounds, joints,actuators, rgba="0 0 1 0.9", keyframe_positions=None, dof_plan=None):
     mj = ET.Element("mujoco", model=name)
     slide_axes = ['x', 'y', 'z']
     extension = ET.SubElement(mj, "extension")
     ET.SubElement(extension, "plugin", plugin="mujoco.elasticity.solid")
     ET.SubElement(mj, "include", file = "scene.xml")
     worldbody = ET.SubElement(mj, "worldbody")
+    vertex_bodies = {}
     for i, (x, y, z) in enumerate(vertices):
         body = ET.SubElement(worldbody, 'body', name=f"v{i+1}", pos=f"{(x)} {(y)} {(z + 0.005)}")
+        vertex_bodies[f"v{i+1}"] = body
         ET.SubElement(body, 'inertial', pos="0 0 0", mass="0.01", diaginertia="1.66667e-05 1.66667e-05 1.66667e-05")
-        if i not in grounds:
-            if (f"v{i+1}") in joints.keys():
-                for j in range(3):  # Handles x, y, z for slide joints
-                    if joints[f"v{i+1}"][j]:
-                        ET.SubElement(body, 'joint', name=f"v{i+1}_j{j+1}", pos="0 0 0", axis= axis_to_string(slide_axes[j]), type="slide")
+        if dof_plan is not None:
+            # Only the joints the DOF reduction pass kept
+            axes = dof_plan["joints"][i]
+        elif i not in grounds and (f"v{i+1}") in joints.keys():
+            axes = [j for j in range(3) if joints[f"v{i+1}"][j]]  # Handles x, y, z for slide joints
+        else:
+            axes = []
+        for j in axes:
+            ET.SubElement(body, 'joint', name=f"v{i+1}_j{j+1}", pos="0 0 0", axis= axis_to_string(slide_axes[j]), type="slide")
     # Add deformable Tsection
     deformable = ET.SubElement(mj, 'deformable')
     # Add flex objects based on edges
@@ -50,37 +85,35 @@ def get_mjcf_flex(name, vertices, edges, grounds, joints,actuators, rgba="0 0 1
 
     # Actuator section 
     actuator_section = ET.SubElement(mj, 'actuator')
+    if dof_plan is not None:
+        actuators = dof_plan["actuators"]
     for actuator in actuators: 
         v, axis = actuator
-        if axis == 0:
-            ax = 'x'
-        if axis == 1:
-            ax = 'y'
-        if axis == 2:
-            ax = 'z'
-        if not joints[v][axis]: 
-            #if the joints required is not there
+        ax = slide_axes[axis]
+        body = vertex_bodies[v]
+        if body.find(f"joint[@name='{v}_j{axis+1}']") is None: 
+            #if the joints required is not there, add it to the actuated vertex
             ET.SubElement(body, 'joint', name=f"{v}_j{axis+1}", pos="0 0 0", axis= axis_to_string(ax), type="slide")
         ET.SubElement(actuator_section, "position", name = f"{v}_act{ax}", joint = f"{v}_j{axis + 1}", kp = "20", dampratio = "1", ctrlrange = "-0.05 0.45")
 
+    # Start from the pre-solved fold state when there is one
+    if keyframe_positions is not None:
+        add_keyframe(mj, vertices, keyframe_positions, actuators)
+
     # Convert the XML tree to a string and print it
     tree = ET.ElementTree(mj)
     ET.indent(tree, space="\t", level=0)
     xml_str = ET.tostring(mj, encoding='unicode')
     return xml_str
 
-if __name__ == '__main__':
-    # 1) get the input from the json file 
-    # Opening JSON file
-    f = open('./designs/design.json')
-    data = json.load(f)
-    # 2) Process input so that we can run the triangulate algorithm, with fixed edges being the folds 
+def design_to_mjcf_inputs(data):
+    ''' Runs the design JSON through body creation and collects everything get_mjcf_flex needs. '''
+    # Process input so that we can run the triangulate algorithm, with fixed edges being the folds 
     vertices, fixed_edges = parse_input_with_bodies.find_and_order_vertices(data)
     edges = parse_input_with_bodies.create_bodies(vertices, data["bodies"])
     vertices_list = []
     for vertex_name in vertices.keys():
         vertices_list.append(vertices[vertex_name])
-    #print("The list of vertices", vertices_list)
     #adding in the z axis and getting things in final form
     vertices = [[x, y, 1] for (x, y) in vertices_list]
     #get grounded vertices
@@ -89,18 +122,38 @@ if __name__ == '__main__':
         coor = data["canvas"][v]
         indx = vertices.index([coor[0], coor[1], 1])
         grounds.append(indx)
-    
-    actuators = data["actuators"]
+    return vertices, edges, grounds, data["joints"], data["actuators"]
+
+if __name__ == '__main__':
+    # 1) get the input from the json file 
+    # Opening JSON file
+    f = open('./designs/design.json')
+    data = json.load(f)
+    # Closing file
+    f.close()
+    # Catch invalid crease patterns before they fail deep in the pipeline
+    diagnostics = validate_design.validate_design(data)
+    for d in diagnostics:
+        print(validate_design.format_diagnostic(d))
+    if validate_design.has_errors(diagnostics):
+        sys.exit("Design has errors, no XML written")
+    # 2) Process input so that we can run the triangulate algorithm, with fixed edges being the folds 
+    vertices, edges, grounds, joints, actuators = design_to_mjcf_inputs(data)
     # print("Triangle arrangement: ", output_connections)
     # print("sorted vertices: ", vertices)
     # print("grounded vertices: ", grounds)
     # print("bodies created: ", edges)
-    # Closing file
-    f.close()
-    joints = data["joints"]
     name = "demo"
-    xml_str = get_mjcf_flex(name, vertices, edges, grounds, joints, actuators)
+    # 3) Keep only the joints the fold mechanism needs
+    dof_plan = dof_reduction.reduce_dofs(vertices, edges, grounds, joints, actuators)
+    print(dof_reduction.format_plan(dof_plan))
+    # 4) Pre-solve the requested fold angles so the simulation starts near the folded state,
+    # moving each vertex only along the joints it is emitted with
+    keyframe_positions = None
+    if data.get("fold_angles"):
+        keyframe_positions, info = fold_presolver.solve_design(data, dof_plan)
+        print(fold_presolver.format_info(info))
+    xml_str = get_mjcf_flex(name, vertices, edges, grounds, joints, actuators, keyframe_positions=keyframe_positions, dof_plan=dof_plan)
     with open(f"./XML_files/{name}.xml", "w") as f:
         f.write(xml_str)
         print(f"Wrote to XML file {name} successfully")
-    
\ No newline at end of file
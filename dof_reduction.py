@@ -0,0 +1,157 @@
+import glob
+import json
+import sys
+import time
+
+import numpy as np
+
+AXIS_NAMES = ['x', 'y', 'z']
+
+
+def flex_neighbours(edges, n):
+    ''' Vertices joined by a flex edge, from the triangulated bodies create_bodies returns.
+    The flex equality constraint keeps each of these edges at its rest length. '''
+    neighbours = [set() for _ in range(n)]
+    for flex_objects in edges.values():
+        for flex_name, triangles in flex_objects.items():
+            body_vertices = [int(v[1:]) - 1 for v in flex_name.split()]
+            if triangles and not isinstance(triangles[0], list):
+                triangles = [triangles]
+            for triangle in triangles:
+                for a, b in ((0, 1), (1, 2), (2, 0)):
+                    i, j = body_vertices[triangle[a]], body_vertices[triangle[b]]
+                    neighbours[i].add(j)
+                    neighbours[j].add(i)
+    return neighbours
+
+
+def spans_plane(points, tolerance=1e-9):
+    ''' True when the points are not all on one line. '''
+    if len(points) < 3:
+        return False
+    offsets = points[1:] - points[0]
+    return np.linalg.matrix_rank(offsets, tol=tolerance * max(1.0, np.abs(offsets).max())) >= 2
+
+
+def spans_space(offsets, tolerance=1e-9):
+    ''' True when the offsets from a vertex to its neighbours are not all in one plane, so the distances
+    to those neighbours pin the vertex down along every axis. '''
+    if len(offsets) < 3:
+        return False
+    return np.linalg.matrix_rank(offsets, tol=tolerance * max(1.0, np.abs(offsets).max())) == 3
+
+
+def legacy_dof_count(vertices, grounds, joints, actuators):
+    ''' Slide joints the emitter produced before this pass: the flagged axes of every non-grounded
+    vertex plus one extra joint for each actuator on an axis that was not flagged. '''
+    count = 0
+    for i in range(len(vertices)):
+        if i not in grounds:
+            count += sum(1 for flag in joints.get(f"v{i+1}", [False] * 3)[:3] if flag)
+    for v, axis in actuators:
+        if not joints.get(v, [False] * 3)[axis]:
+            count += 1
+    return count
+
+
+def reduce_dofs(vertices, edges, grounds, joints, actuators, tolerance=1e-9):
+    ''' Decides which slide joints the generated model needs. It works from the fold/body topology
+    (the flex edges), the grounded set and the actuators:
+    - grounded vertices get no joints, and actuators on them are dropped;
+    - actuated axes always get a joint, on the actuated vertex;
+    - a vertex tied by flex edges to fixed neighbours is only held in place when those edges leave it no
+      motion at all. Anchors whose offsets span 3D do that. Anchors that span a plane with the vertex only
+      hold it within the plane (on the flat sheet, the xy plane); the vertex can still sag out of it,
+      and sagging needs the small in-plane slide that keeps the edges at their length. So such a vertex is
+      only fixed when it has no joint along the plane normal either. This is repeated until nothing changes;
+    - a vertex that is part of no body is only moved by gravity, so it is fixed unless actuated.
+    Only the x, y, z flags of a joints entry are read; vertex bodies are point masses, so the
+    rotational flags have nothing to turn.
+    Returns a plan with the joint axes per vertex index, the kept actuators and what was removed and why. '''
+    n = len(vertices)
+    points = np.array(vertices, dtype=float).reshape(-1, 3)
+    neighbours = flex_neighbours(edges, n)
+    requested = [set() if i in grounds else {j for j in range(3) if joints.get(f"v{i+1}", [False] * 3)[j]}
+                 for i in range(n)]
+    actuated = [set() for _ in range(n)]
+    kept_actuators, dropped_actuators = [], []
+    for v, axis in actuators:
+        i = int(v[1:]) - 1
+        if i in grounds:
+            dropped_actuators.append((v, axis, "vertex is grounded"))
+        else:
+            actuated[i].add(axis)
+            kept_actuators.append([v, axis])
+
+    removed = {}
+    fixed = {i for i in range(n) if not requested[i] and not actuated[i]}
+    for i in range(n):
+        if not neighbours[i] and requested[i] and not actuated[i]:
+            removed[i] = "not part of any body"
+            fixed.add(i)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(n):
+            if i in fixed or actuated[i]:
+                continue
+            anchors = [j for j in neighbours[i] if j in fixed]
+            offsets = points[anchors] - points[i]
+            if spans_space(offsets, tolerance):
+                removed[i] = "held in place by fixed neighbours " + ", ".join(f"v{j+1}" for j in sorted(anchors))
+            else:
+                # The plane the vertex shares with its anchors, when it is an axis plane the vertex has no joint across
+                planes = [normal for normal in range(3) if normal not in requested[i]
+                          and spans_plane(points[[j for j, offset in zip(anchors, offsets) if abs(offset[normal]) <= tolerance]], tolerance)]
+                if not planes:
+                    continue
+                in_plane = "".join(AXIS_NAMES[a] for a in range(3) if a != planes[0])
+                removed[i] = f"held in the {in_plane} plane by fixed neighbours " + ", ".join(f"v{j+1}" for j in sorted(anchors))
+            fixed.add(i)
+            changed = True
+
+    plan_joints = {i: sorted(actuated[i] | (set() if i in removed else requested[i])) for i in range(n)}
+    return {
+        "joints": plan_joints,
+        "actuators": kept_actuators,
+        "removed": {f"v{i+1}": (sorted(requested[i]), reason) for i, reason in removed.items()},
+        "dropped_actuators": dropped_actuators,
+        "dofs_before": legacy_dof_count(vertices, grounds, joints, actuators),
+        "dofs_after": sum(len(axes) for axes in plan_joints.values()),
+    }
+
+
+def format_plan(plan):
+    lines = [f"DOFs: {plan['dofs_before']} -> {plan['dofs_after']}"]
+    for v, (axes, reason) in plan["removed"].items():
+        lines.append(f"  removed {v} {' '.join(AXIS_NAMES[a] for a in axes)}: {reason}")
+    for v, axis, reason in plan["dropped_actuators"]:
+        lines.append(f"  dropped actuator {v} {AXIS_NAMES[axis]}: {reason}")
+    return "\n".join(lines)
+
+
+def time_steps(model, steps=2000, repeats=5):
+    ''' Wall time of one mj_step from the model's initial state, best of several runs of steps. '''
+    import mujoco
+    best = float("inf")
+    for _ in range(repeats):
+        data = mujoco.MjData(model)
+        start = time.perf_counter()
+        for _ in range(steps):
+            mujoco.mj_step(model, data)
+        best = min(best, (time.perf_counter() - start) / steps)
+    return best
+
+
+if __name__ == '__main__':
+    # Report the DOF and step time reduction for saved designs: python dof_reduction.py [design.json ...]
+    import preview
+    paths = sys.argv[1:] or sorted(glob.glob('./designs/*.json'))
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+        full = preview.compile_design(data, reduce=False)
+        reduced = preview.compile_design(data)
+        full_time, reduced_time = time_steps(full), time_steps(reduced)
+        print(f"{path}: nv {full.nv} -> {reduced.nv}, "
+              f"step {full_time * 1e6:.1f} us -> {reduced_time * 1e6:.1f} us")
@@ -0,0 +1,277 @@
+import json
+import math
+import sys
+
+import numpy as np
+
+import parse_input_with_bodies
+
+# A requested fold angle the solve misses by more than this (degrees) is reported as unreachable.
+ANGLE_TOLERANCE = 0.5
+
+
+def rotation_matrices(axes, angles):
+    ''' Rodrigues' formula for a batch of unit axes (k, 3) and angles (k,), giving (k, 3, 3). '''
+    k = np.zeros((len(axes), 3, 3))
+    k[:, 0, 1], k[:, 0, 2] = -axes[:, 2], axes[:, 1]
+    k[:, 1, 0], k[:, 1, 2] = axes[:, 2], -axes[:, 0]
+    k[:, 2, 0], k[:, 2, 1] = -axes[:, 1], axes[:, 0]
+    sin = np.sin(angles)[:, None, None]
+    cos = np.cos(angles)[:, None, None]
+    return np.eye(3) + sin * k + (1 - cos) * (k @ k)
+
+
+def collect_panels(vertex_names, bodies):
+    ''' Vertex indices of each panel, read from the body partition create_bodies returns. '''
+    panels = []
+    for flex_objects in bodies.values():
+        for body_vertices in flex_objects.keys():
+            panels.append([vertex_names.index(v) for v in body_vertices.split()])
+    return panels
+
+
+def collect_hinges(vertex_names, panels, folds, fold_angles):
+    ''' Pairs every fold with the two panels on either side of it. Returns one entry per hinge:
+    (fold name, panel a, panel b, vertex i, vertex j, target angle in radians, sign). Positive angles
+    fold the panels up towards each other (valley), negative angles down (mountain). '''
+    hinges = []
+    for kind, sign in (("valley", 1.0), ("mountain", -1.0)):
+        for fold_name, ends in folds.get(kind, {}).items():
+            a, b = (vertex_names.index(v) for v in list(ends.keys())[:2])
+            sides = [p for p, panel in enumerate(panels) if a in panel and b in panel]
+            if len(sides) < 2:
+                continue
+            target = sign * math.radians(fold_angles.get(fold_name, 0.0))
+            hinges.append((fold_name, sides[0], sides[1], a, b, target, sign))
+    return hinges
+
+
+class FoldKinematics:
+    ''' Rigid-panel kinematics of a crease pattern. The panels and folds form a graph; a spanning tree
+    of it is posed by composing one rotation per tree fold. Every fold outside the tree is a loop that has
+    to close, and every pinned vertex axis has to stay where it is in the flat sheet. '''
+
+    def __init__(self, points, panels, hinges, root=0, pinned_axes=None):
+        self.points = points
+        self.panels = panels
+        self.hinges = hinges
+        n_panels = len(panels)
+        adjacency = [[] for _ in range(n_panels)]
+        for h, (_, pa, pb, _, _, _, _) in enumerate(hinges):
+            adjacency[pa].append((h, pb))
+            adjacency[pb].append((h, pa))
+
+        # Breadth first spanning tree, one level at a time so poses can be composed level by level.
+        self.parent = np.full(n_panels, -1)
+        self.parent_hinge = np.full(n_panels, -1)
+        self.levels = []
+        seen = np.zeros(n_panels, dtype=bool)
+        for start in [root] + list(range(n_panels)):
+            if seen[start]:
+                continue
+            seen[start] = True
+            frontier = [start]
+            while frontier:
+                following = []
+                for panel in frontier:
+                    for h, other in adjacency[panel]:
+                        if not seen[other]:
+                            seen[other] = True
+                            self.parent[other] = panel
+                            self.parent_hinge[other] = h
+                            following.append(other)
+                if following:
+                    self.levels.append(np.array(following))
+                frontier = following
+        self.tree_hinges = np.array([h for h in self.parent_hinge if h >= 0], dtype=int)
+        self.loop_hinges = np.array(sorted(set(range(len(hinges))) - set(self.tree_hinges.tolist())), dtype=int)
+
+        # Hinge axes in the flat sheet, oriented so a positive angle lifts the child panel.
+        self.child = np.full(len(hinges), -1)
+        for panel, h in enumerate(self.parent_hinge):
+            if h >= 0:
+                self.child[h] = panel
+        for h in self.loop_hinges:
+            self.child[h] = hinges[h][2]
+        centroids = np.array([points[panel].mean(axis=0) for panel in panels])
+        self.anchor = points[[hinge[3] for hinge in hinges]].reshape(-1, 3)
+        axes = points[[hinge[4] for hinge in hinges]].reshape(-1, 3) - self.anchor
+        axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+        lift = np.cross(axes, centroids[self.child] - self.anchor)[:, 2]
+        self.axes = np.where((lift < 0)[:, None], -axes, axes)
+
+        # ancestors[p, h] is True when hinge h lies on the tree path from the root to panel p.
+        self.ancestors = np.zeros((n_panels, len(hinges)), dtype=bool)
+        for level in self.levels:
+            self.ancestors[level] = self.ancestors[self.parent[level]]
+            self.ancestors[level, self.parent_hinge[level]] = True
+
+        # Constraint rows as (panel a, panel b or -1 for the world, vertex, axis).
+        rows = []
+        for h in self.loop_hinges:
+            _, pa, pb, i, j, _, _ = hinges[h]
+            rows += [(pa, pb, v, axis) for v in (i, j) for axis in range(3)]
+        for v, axes in (pinned_axes or {}).items():
+            for p, panel in enumerate(panels):
+                if v in panel:
+                    rows += [(p, -1, v, axis) for axis in axes]
+        self.rows = tuple(np.array(column, dtype=int) for column in zip(*rows)) if rows else (np.zeros(0, dtype=int),) * 4
+
+    def pose(self, angles):
+        ''' World rotation and translation of every panel for the given hinge angles. Only tree hinge
+        angles are used; loop hinges follow from the panels they join. '''
+        n_panels = len(self.panels)
+        rotations = np.tile(np.eye(3), (n_panels, 1, 1))
+        translations = np.zeros((n_panels, 3))
+        local = rotation_matrices(self.axes, angles)
+        local_translations = self.anchor - np.einsum("hij,hj->hi", local, self.anchor)
+        for level in self.levels:
+            parents = self.parent[level]
+            hinges = self.parent_hinge[level]
+            rotations[level] = rotations[parents] @ local[hinges]
+            translations[level] = np.einsum("pij,pj->pi", rotations[parents], local_translations[hinges]) + translations[parents]
+        return rotations, translations
+
+    def constraint_residual(self, angles):
+        ''' Violation of every constraint, one scalar per row: the gap between the two panels of each loop hinge
+        at both hinge end points, and how far each pinned vertex axis has left the flat sheet. Returned with its
+        Jacobian with respect to the hinge angles. '''
+        rotations, translations = self.pose(angles)
+        pa, pb, point, axis = self.rows
+        if len(pa) == 0:
+            return np.zeros(0), np.zeros((0, len(self.hinges))), rotations, translations
+        flat = self.points[point]
+        world_a = np.einsum("rij,rj->ri", rotations[pa], flat) + translations[pa]
+        on_panel_b = pb >= 0
+        world_b = flat.copy()
+        world_b[on_panel_b] = np.einsum("rij,rj->ri", rotations[pb[on_panel_b]], flat[on_panel_b]) + translations[pb[on_panel_b]]
+        rows = np.arange(len(pa))
+        residual = (world_a - world_b)[rows, axis]
+
+        # Tree hinge h turns everything below it about its world axis through its world anchor.
+        owner = self.parent[self.child]
+        owner = np.where(owner >= 0, owner, 0)
+        world_axes = np.einsum("hij,hj->hi", rotations[owner], self.axes)
+        world_anchor = np.einsum("hij,hj->hi", rotations[owner], self.anchor) + translations[owner]
+        motion_a = np.cross(world_axes[None, :, :], world_a[:, None, :] - world_anchor[None, :, :])[rows, :, axis]
+        motion_b = np.cross(world_axes[None, :, :], world_b[:, None, :] - world_anchor[None, :, :])[rows, :, axis]
+        ancestors_b = self.ancestors[np.where(on_panel_b, pb, 0)] & on_panel_b[:, None]
+        jacobian = self.ancestors[pa] * motion_a - ancestors_b * motion_b
+        return residual, jacobian, rotations, translations
+
+    def fold_angles(self, rotations):
+        ''' Signed angle each hinge actually folds by, in the same convention as the targets. '''
+        pa = np.array([hinge[1] for hinge in self.hinges], dtype=int)
+        pb = np.array([hinge[2] for hinge in self.hinges], dtype=int)
+        parent_side = np.where(self.child == pb, pa, pb)
+        normal_parent = rotations[parent_side][:, :, 2]
+        normal_child = rotations[self.child][:, :, 2]
+        world_axes = np.einsum("hij,hj->hi", rotations[parent_side], self.axes)
+        sin = np.sum(world_axes * np.cross(normal_parent, normal_child), axis=1)
+        cos = np.sum(normal_parent * normal_child, axis=1)
+        return np.arctan2(sin, cos)
+
+
+def solve_fold_state(vertices, bodies, folds, fold_angles, pinned=None, height=1,
+                     iterations=100, damping=1e-3, tolerance=1e-10):
+    ''' Poses the crease pattern as rigid panels folded by the requested angles (degrees, keyed by fold name).
+    vertices is the dictionary from find_and_order_vertices and bodies the partition from create_bodies.
+    Starting from the requested angles on a spanning tree of the folds, damped least squares steps close
+    every loop of folds and keep pinned vertices in place while moving the angles as little as possible.
+    pinned maps vertex names to the axes (0, 1, 2) along which the model cannot move them.
+    Returns the folded vertex positions, in the order of vertices, and a dictionary describing the solve. '''
+    vertex_names = list(vertices.keys())
+    points = np.array([[x, y, height] for (x, y) in vertices.values()], dtype=float)
+    panels = collect_panels(vertex_names, bodies)
+    hinges = collect_hinges(vertex_names, panels, folds, fold_angles)
+    pinned_axes = {vertex_names.index(v): axes for v, axes in (pinned or {}).items() if v in vertices and axes}
+    # The panel holding the most pinned vertices is the one that stays put
+    root = max(range(len(panels)), key=lambda p: sum(v in pinned_axes for v in panels[p]), default=0)
+    if not hinges:
+        return points, {"iterations": 0, "residual": 0.0, "angles": {}, "unreachable": {}, "unknown": list(fold_angles)}
+    kinematics = FoldKinematics(points, panels, hinges, root, pinned_axes)
+    angles = np.array([hinge[5] for hinge in hinges])
+    residual, jacobian, rotations, translations = kinematics.constraint_residual(angles)
+    step = 0
+    for step in range(iterations):
+        if residual.size == 0 or residual @ residual <= tolerance:
+            break
+        # Damped least squares: dq = J^T (J J^T + lambda^2 I)^-1 (-r)
+        system = jacobian @ jacobian.T + damping ** 2 * np.eye(len(residual))
+        angles = angles + jacobian.T @ np.linalg.solve(system, -residual)
+        residual, jacobian, rotations, translations = kinematics.constraint_residual(angles)
+
+    # A vertex shared by several panels takes the mean of its positions on each of them.
+    owners = np.array([p for p, panel in enumerate(panels) for _ in panel], dtype=int)
+    members = np.array([v for panel in panels for v in panel], dtype=int)
+    placed = np.einsum("kij,kj->ki", rotations[owners], points[members]) + translations[owners]
+    folded = points.copy()
+    counts = np.bincount(members, minlength=len(points))
+    sums = np.zeros_like(points)
+    np.add.at(sums, members, placed)
+    used = counts > 0
+    folded[used] = sums[used] / counts[used][:, None]
+
+    achieved = kinematics.fold_angles(rotations)
+    angles = {hinge[0]: math.degrees(a) * hinge[6] for hinge, a in zip(hinges, achieved)}
+    info = {
+        "iterations": step,
+        "residual": float(np.sqrt(residual @ residual)) if residual.size else 0.0,
+        "angles": angles,
+        # Requested folds the loops and pins keep away from their angle, as (requested, achieved)
+        "unreachable": {fold_name: (requested, angles[fold_name]) for fold_name, requested in fold_angles.items()
+                        if fold_name in angles and abs(angles[fold_name] - requested) > ANGLE_TOLERANCE},
+        # Requested folds that are not a crease between two bodies
+        "unknown": [fold_name for fold_name in fold_angles if fold_name not in angles],
+    }
+    return folded, info
+
+
+def emitted_joint_axes(vertex_names, data, dof_plan=None):
+    ''' The slide joint axes get_mjcf_flex gives each vertex: the ones the DOF reduction plan kept, or
+    without a plan the flagged axes of every non-grounded vertex plus every actuated axis. '''
+    if dof_plan is not None:
+        return {v: set(dof_plan["joints"][i]) for i, v in enumerate(vertex_names)}
+    grounded = data.get("grounded_vertices", [])
+    axes = {}
+    for v in vertex_names:
+        flags = data.get("joints", {}).get(v, [False] * 3)
+        axes[v] = set() if v in grounded else {axis for axis in range(3) if flags[axis]}
+    for v, axis in data.get("actuators", []):
+        if v in axes:
+            axes[v].add(axis)
+    return axes
+
+
+def solve_design(data, dof_plan=None):
+    ''' Runs the pre-solver on a design dictionary that has a "fold_angles" entry. Pass the DOF reduction
+    plan the model is emitted with, if any, so the pins match the joints the model really has.
+    Positions come back in the vertex order create.py uses, at the height create.py places the sheet. '''
+    vertices, _ = parse_input_with_bodies.find_and_order_vertices(data)
+    bodies = parse_input_with_bodies.create_bodies(vertices, data["bodies"])
+    # A vertex can only leave the flat sheet along the axes it has a slide joint for
+    free = emitted_joint_axes(list(vertices.keys()), data, dof_plan)
+    pinned = {v: [axis for axis in range(3) if axis not in free[v]] for v in vertices}
+    return solve_fold_state(vertices, bodies, data["folds"], data.get("fold_angles", {}), pinned=pinned)
+
+
+def format_info(info):
+    ''' The solve summary create.py and this module print. '''
+    lines = [f"Solved in {info['iterations']} iterations, loop closure error {info['residual']:.2e}"]
+    for fold_name, (requested, achieved) in info["unreachable"].items():
+        lines.append(f"  {fold_name}: requested {requested:.1f} degrees, reached {achieved:.1f}; "
+                     "the loops or pinned vertices do not allow it")
+    for fold_name in info["unknown"]:
+        lines.append(f"  {fold_name}: not a fold between two bodies, its angle is ignored")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    # Print the pre-solved fold state of a saved design: python fold_presolver.py [design.json]
+    path = sys.argv[1] if len(sys.argv) > 1 else './designs/design.json'
+    with open(path) as f:
+        data = json.load(f)
+    folded, info = solve_design(data)
+    print(format_info(info))
+    for fold_name, angle in info["angles"].items():
+        print(f"{fold_name}: {angle:.1f} degrees")
@@ -2,6 +2,8 @@ import pygame
 import sys
 import math
 import json
+import preview
+import validate_design
 
 # Initialize Pygame
 pygame.init()
@@ -13,6 +15,11 @@ VERTEX_COLOR = (0, 0, 255)
 LINE_COLOR_CHOICES = [(0, 0, 255), (255, 0, 0), (255, 255, 0)]
 VERTEX_RADIUS = 20
 LINE_WIDTH = 3
+FPS = 60
+ZOOM_STEP = 1.1
+MIN_ZOOM, MAX_ZOOM = 0.05, 10.0
+PAN_STEP = 40
+GRID_CELL = 200  # canvas units per bucket of the spatial index used to draw part of the layer
 
 JOINT_TYPES = ['X Linear', 'Y Linear', 'Z Linear', 'X Rotational', 'Y Rotational', 'Z Rotational', 'X-pos Actuator', 'Y-pos Actuator', 'Z-pos Actuator', 'Grounded']
 BAR_WIDTH = 200
@@ -29,44 +36,189 @@ valley_folds = []
 
 faces = []
 faces_to_draw = []
+face_outlines = []  # (counterclockwise outline, bounding box) of each face in faces_to_draw
+vertex_cells = {}  # grid cell -> vertices inside it, rebuilt with the geometry layer
+edge_cells = {}  # grid cell -> edges (vertex, neighbour) whose bounding box touches it
 joints = {}
 actuators = {}
 grounds = {}
 
-def draw_vertices():
-    ''' Draws all the vertices on the GUI with the assigned color and radius. 
-    Also draws indicators for acitive joints. '''
+# View state for zoom and pan. Vertices are stored in canvas coordinates; the window shows them scaled by view_zoom.
+view_zoom = 1.0
+view_offset = [0.0, 0.0]
+
+# Cached render layers
+geometry_layer = pygame.Surface((WIDTH, HEIGHT))
+joint_selection_bar = None
+
+def world_to_screen(pos):
+    ''' Converts a canvas position to a position in the window, applying the current zoom and pan. '''
+    return ((pos[0] - view_offset[0]) * view_zoom, (pos[1] - view_offset[1]) * view_zoom)
+
+def screen_to_world(pos):
+    ''' Converts a click in the window back to canvas coordinates, snapped to whole pixels. '''
+    return (round(pos[0] / view_zoom + view_offset[0]), round(pos[1] / view_zoom + view_offset[1]))
+
+def zoom_at(screen_pos, factor):
+    ''' Zooms the view by factor while keeping the canvas point under screen_pos fixed. '''
+    global view_zoom
+    anchor_x = screen_pos[0] / view_zoom + view_offset[0]
+    anchor_y = screen_pos[1] / view_zoom + view_offset[1]
+    view_zoom = min(MAX_ZOOM, max(MIN_ZOOM, view_zoom * factor))
+    view_offset[0] = anchor_x - screen_pos[0] / view_zoom
+    view_offset[1] = anchor_y - screen_pos[1] / view_zoom
+
+def pan_by(dx, dy):
+    ''' Pans the view by a distance given in window pixels. '''
+    view_offset[0] -= dx / view_zoom
+    view_offset[1] -= dy / view_zoom
+
+def visible_bounds(area, margin=0):
+    ''' The canvas region shown in the given window area, grown by margin. Used to cull geometry outside it. '''
+    left = area.left / view_zoom + view_offset[0]
+    top = area.top / view_zoom + view_offset[1]
+    return (left - margin, top - margin, left + area.width / view_zoom + margin, top + area.height / view_zoom + margin)
+
+def index_geometry():
+    ''' Buckets the vertices and edges into GRID_CELL sized cells, so that drawing a strip of the 
+    layer only visits the geometry near it. The index is in canvas units, so it only has to be 
+    rebuilt when the design changes, not on zoom or pan. Every edge is stored under both of its 
+    vertices, so it is indexed from its smaller endpoint. '''
+    global vertex_cells, edge_cells
+    vertex_cells = {}
+    edge_cells = {}
     for vertex in graph.keys():
-        pygame.draw.circle(screen, VERTEX_COLOR, vertex, VERTEX_RADIUS)
+        index_vertex(vertex)
+        for neighbour in graph[vertex]:
+            if neighbour[0] > vertex:
+                index_edge(vertex, neighbour)
+
+def index_vertex(vertex):
+    ''' Adds a new vertex to the grid index. '''
+    vertex_cells.setdefault((int(vertex[0] // GRID_CELL), int(vertex[1] // GRID_CELL)), []).append(vertex)
+
+def index_edge(vertex, neighbour):
+    ''' Adds a new edge, given as an entry of graph[vertex], to the grid index. '''
+    other = neighbour[0]
+    for cell in cells_in((min(vertex[0], other[0]), min(vertex[1], other[1]),
+                          max(vertex[0], other[0]), max(vertex[1], other[1]))):
+        edge_cells.setdefault(cell, []).append((vertex, neighbour))
+
+def connect_vertices(a, b):
+    ''' Adds a boundary edge between two vertices and indexes it. '''
+    graph[a].append([b, 0])
+    graph[b].append([a, 0])
+    if a < b:
+        index_edge(a, graph[a][-1])
+    else:
+        index_edge(b, graph[b][-1])
+
+def cells_in(bounds):
+    ''' The grid cells overlapping a (left, top, right, bottom) canvas region. '''
+    left, top, right, bottom = bounds
+    return [(i, j) for i in range(int(left // GRID_CELL), int(right // GRID_CELL) + 1)
+            for j in range(int(top // GRID_CELL), int(bottom // GRID_CELL) + 1)]
+
+def draw_vertices(surface, area):
+    ''' Draws all the vertices inside area with the assigned color and radius. 
+    Also draws indicators for acitive joints. '''
+    radius = max(1, VERTEX_RADIUS * view_zoom)
+    left, top, right, bottom = visible_bounds(area, VERTEX_RADIUS)
+    cells = cells_in((left, top, right, bottom))
+    if len(cells) > len(vertex_cells):
+        cells = list(vertex_cells)
+    for vertex in [v for cell in cells for v in vertex_cells.get(cell, ())]:
+        if not (left <= vertex[0] <= right and top <= vertex[1] <= bottom):
+            continue
+        center = world_to_screen(vertex)
+        pygame.draw.circle(surface, VERTEX_COLOR, center, radius)
         if vertex in joints:
             for i, is_active in enumerate(joints[vertex]):
                 if is_active:
-                    indicator_pos = (vertex[0] + 15 * math.cos(i * math.pi / 3),
-                                     vertex[1] + 15 * math.sin(i * math.pi / 3))
-                    pygame.draw.circle(screen, (255, 0, 0), indicator_pos, 3)
+                    indicator_pos = (center[0] + 15 * view_zoom * math.cos(i * math.pi / 3),
+                                     center[1] + 15 * view_zoom * math.sin(i * math.pi / 3))
+                    pygame.draw.circle(surface, (255, 0, 0), indicator_pos, 3)
         if vertex in actuators:
             for i, is_active in enumerate(actuators[vertex]):
                 if is_active:
-                    indicator_pos = (vertex[0] + 20 * math.cos((i + 6) * math.pi / 3),
-                                     vertex[1] + 20 * math.sin((i + 6) * math.pi / 3))
-                    pygame.draw.circle(screen, (0, 255, 0), indicator_pos, 3)
-
-def draw_lines():
-    ''' Draws the edges between vertices. Some edges represents a boundary edge, if it is blue. 
-    Mountain folds are red and valley folds are yellow. '''
-    for vertex in graph.keys():
-        for neighbour in graph[vertex]:   
-            pygame.draw.line(screen, LINE_COLOR_CHOICES[neighbour[1]], neighbour[0], vertex, LINE_WIDTH)
-
-def draw_faces():
-    ''' Draws all the selected faces on the GUI canvas. '''
+                    indicator_pos = (center[0] + 20 * view_zoom * math.cos((i + 6) * math.pi / 3),
+                                     center[1] + 20 * view_zoom * math.sin((i + 6) * math.pi / 3))
+                    pygame.draw.circle(surface, (0, 255, 0), indicator_pos, 3)
+
+def draw_lines(surface, area):
+    ''' Draws the edges between vertices that cross area. Some edges represents a boundary edge, if it is blue. 
+    Mountain folds are red and valley folds are yellow. An edge crossing several grid cells is only drawn once. '''
+    left, top, right, bottom = visible_bounds(area, LINE_WIDTH)
+    cells = cells_in((left, top, right, bottom))
+    if len(cells) > len(edge_cells):
+        cells = list(edge_cells)
+    drawn = set()
+    for cell in cells:
+        for vertex, neighbour in edge_cells.get(cell, ()):
+            other = neighbour[0]
+            if ((vertex[0] < left and other[0] < left) or (vertex[0] > right and other[0] > right) or
+                    (vertex[1] < top and other[1] < top) or (vertex[1] > bottom and other[1] > bottom)):
+                continue
+            if (vertex, other) in drawn:
+                continue
+            drawn.add((vertex, other))
+            pygame.draw.line(surface, LINE_COLOR_CHOICES[neighbour[1]], world_to_screen(other), world_to_screen(vertex), LINE_WIDTH)
+
+def add_face_to_draw(face):
+    ''' Selects a face as a body, caching its sorted outline and bounding box for drawing. '''
+    faces_to_draw.append(face)
+    xs = [p[0] for p in face]
+    ys = [p[1] for p in face]
+    face_outlines.append((sort_points_counterclockwise(face), (min(xs), min(ys), max(xs), max(ys))))
+
+def draw_faces(surface, area):
+    ''' Draws the selected faces that overlap area. '''
     color = [173, 216, 50]
-    for face in faces_to_draw:
-        sorted_face =  sort_points_counterclockwise(face)
-        pygame.draw.polygon(screen, (color[0], color[1], color[2]) , sorted_face)  # Draw face outlines in light gray
+    left, top, right, bottom = visible_bounds(area)
+    for outline, (min_x, min_y, max_x, max_y) in face_outlines:
+        if max_x >= left and min_x <= right and max_y >= top and min_y <= bottom:
+            pygame.draw.polygon(surface, (color[0], color[1], color[2]) , [world_to_screen(p) for p in outline])  # Draw face outlines in light gray
         color[2] += 20
         color[2] = color[2] % 255
 
+def render_geometry(area):
+    ''' Re-renders one window area of the cached layer holding the faces, edges and vertices. '''
+    geometry_layer.set_clip(area)
+    geometry_layer.fill(BACKGROUND_COLOR, area)
+    draw_vertices(geometry_layer, area)
+    draw_lines(geometry_layer, area)
+    draw_faces(geometry_layer, area)
+    geometry_layer.set_clip(None)
+
+def rebuild_geometry_layer():
+    ''' Re-renders the whole cached layer. Only called when the zoom has changed, or an edit 
+    changed the design all over. '''
+    render_geometry(geometry_layer.get_rect())
+
+def damaged_rect(points):
+    ''' The window region an edit around the given canvas points can change: the points with their 
+    vertex circles and joint indicators. '''
+    margin = VERTEX_RADIUS * view_zoom + 25 * view_zoom + 4
+    xs, ys = zip(*[world_to_screen(p) for p in points])
+    rect = pygame.Rect(min(xs) - margin, min(ys) - margin, max(xs) - min(xs) + 2 * margin + 1, max(ys) - min(ys) + 2 * margin + 1)
+    return rect.clip(geometry_layer.get_rect())
+
+def scroll_geometry_layer(dx, dy):
+    ''' Moves the cached layer by a pan of (dx, dy) window pixels and renders only the strips 
+    that scroll into view. The view offset has already been moved by pan_by. '''
+    if abs(dx) >= WIDTH or abs(dy) >= HEIGHT:
+        rebuild_geometry_layer()
+        return
+    geometry_layer.scroll(dx, dy)
+    if dx > 0:
+        render_geometry(pygame.Rect(0, 0, dx, HEIGHT))
+    elif dx < 0:
+        render_geometry(pygame.Rect(WIDTH + dx, 0, -dx, HEIGHT))
+    if dy > 0:
+        render_geometry(pygame.Rect(0, 0, WIDTH, dy))
+    elif dy < 0:
+        render_geometry(pygame.Rect(0, HEIGHT + dy, WIDTH, -dy))
+
 def draw_joint_properties(vertex, properties):
     ''' Draws whether certain joints have been selected. '''
     x, y = vertex
@@ -76,27 +228,44 @@ def draw_joint_properties(vertex, properties):
             # This is a simple example; you might want to create more sophisticated graphics
             color = (255, 0, 0) if i < 3 else (0, 255, 0)  # Red for linear, Green for rotational
             pygame.draw.circle(screen, color, (x + (i-3)*10, y + (i//3)*10), 3)
-            
-def draw_joint_selection_bar():
-    ''' If the key J is clicked, this shows a display bar that allows user to input joint information'''
-    pygame.draw.rect(screen, (200, 200, 200), (*BAR_POSITION, BAR_WIDTH, BAR_HEIGHT))
+
+def build_joint_selection_bar():
+    ''' Pre-renders the joint selection bar and its labels once, so showing it is a single blit. '''
+    bar = pygame.Surface((BAR_WIDTH, BAR_HEIGHT))
+    bar.fill((200, 200, 200))
+    font = pygame.font.Font(None, 24)
     for i, joint_type in enumerate(JOINT_TYPES):
-        button_rect = (BAR_POSITION[0], BAR_POSITION[1] + i * 30, BAR_WIDTH, 25)
-        pygame.draw.rect(screen, (150, 150, 150), button_rect)
-        font = pygame.font.Font(None, 24)
+        button_rect = (0, i * 30, BAR_WIDTH, 25)
+        pygame.draw.rect(bar, (150, 150, 150), button_rect)
         text = font.render(joint_type, True, (0, 0, 0))
-        screen.blit(text, (button_rect[0] + 5, button_rect[1] + 5))
+        bar.blit(text, (button_rect[0] + 5, button_rect[1] + 5))
+    return bar
+
+def draw_joint_selection_bar():
+    ''' If the key J is clicked, this shows a display bar that allows user to input joint information'''
+    screen.blit(joint_selection_bar, BAR_POSITION)
+
+def selected_vertex_rect(vertex):
+    ''' The window region covered by the highlight ring around a selected vertex. '''
+    x, y = world_to_screen(vertex)
+    radius = max(1, VERTEX_RADIUS * view_zoom) + 3
+    return pygame.Rect(x - radius, y - radius, 2 * radius + 1, 2 * radius + 1)
+
+def nearby_vertices(pos, distance):
+    ''' Vertices from the grid cells within distance of a canvas position. '''
+    cells = cells_in((pos[0] - distance, pos[1] - distance, pos[0] + distance, pos[1] + distance))
+    return [v for cell in cells for v in vertex_cells.get(cell, ())]
 
 def find_vertex(pos):
     ''' From the position of a click, determine whether the user is trying to click on a vertex. '''
-    for vertex in graph.keys():
+    for vertex in nearby_vertices(pos, VERTEX_RADIUS):
         if math.sqrt((vertex[0] - pos[0]) ** 2 + (vertex[1] - pos[1]) ** 2) <= VERTEX_RADIUS:
             return vertex
     return None
 
 def find_is_there_nearby_vertex(pos):
     ''' Match the position of a click to see if it is position is close to any of the exitsting vertices. '''
-    for vertex in graph.keys():
+    for vertex in nearby_vertices(pos, 30):
         if math.sqrt((vertex[0] - pos[0]) ** 2 + (vertex[1] - pos[1]) ** 2) <= 30:
             return True
     return False
@@ -121,21 +290,21 @@ def point_line_distance(px, py, x1, y1, x2, y2):
     return math.sqrt((px - closest_x) ** 2 + (py - closest_y) ** 2)
 
 def find_line(pos, graph, threshold=10):
-    ''' Finds a line. '''
+    ''' Finds a line. Only the lines in the grid cells around the click are tested. '''
     px, py = pos
-    for vertex in graph.keys():
+    cells = cells_in((px - threshold, py - threshold, px + threshold, py + threshold))
+    for vertex, neighbour in [edge for cell in cells for edge in edge_cells.get(cell, ())]:
         x1, y1 = vertex
-        for neighbour in graph[vertex]:
-            x2, y2 = neighbour[0][0], neighbour[0][1]
-            if point_line_distance(px, py, x1, y1, x2, y2) <= threshold:
-                if not (math.sqrt((x1 - px) ** 2 + (y1 - py) ** 2) <= VERTEX_RADIUS or
-                        math.sqrt((x2 - px) ** 2 + (y2 - py) ** 2) <= VERTEX_RADIUS):
-                    neighbour[1] = (neighbour[1] + 1) % len(LINE_COLOR_CHOICES)
-                    for n in graph[neighbour[0]]:
-                        if n[0] == vertex:
-                            n[1]= neighbour[1]
-                    find_folds(graph)
-                    return neighbour[0], vertex
+        x2, y2 = neighbour[0][0], neighbour[0][1]
+        if point_line_distance(px, py, x1, y1, x2, y2) <= threshold:
+            if not (math.sqrt((x1 - px) ** 2 + (y1 - py) ** 2) <= VERTEX_RADIUS or
+                    math.sqrt((x2 - px) ** 2 + (y2 - py) ** 2) <= VERTEX_RADIUS):
+                neighbour[1] = (neighbour[1] + 1) % len(LINE_COLOR_CHOICES)
+                for n in graph[neighbour[0]]:
+                    if n[0] == vertex:
+                        n[1]= neighbour[1]
+                find_folds(graph)
+                return neighbour[0], vertex
     return False
 
 def delete_vertex(vertex):
@@ -177,11 +346,12 @@ def align_vertex(pos):
 
 def find_folds(graph):
     ''' Changes the status of an edge, rotating between a mountain, valley and boundary edge. '''
-    global mountain_folds, valley_folds, faces, faces_to_draw
+    global mountain_folds, valley_folds, faces, faces_to_draw, face_outlines
     mountain_folds = []
     valley_folds = []
     faces = []
     faces_to_draw = []
+    face_outlines = []
     for v in graph.keys():
         for neighbor in graph[v]:
             if neighbor[1] == 1:
@@ -293,9 +463,9 @@ def toggle_joint_property(vertex, property_index):
     else: 
         grounds[vertex] = not grounds[vertex]
 
-def save_to_json(graph, mountain_folds, valley_folds, faces_to_draw, grounds):
-    ''' When the user hits the ENTER key, this function collects all the information 
-    into a Json file in a format create.py is able to parse and output to an XML file. '''
+def design_to_dict(graph, mountain_folds, valley_folds, faces_to_draw, grounds):
+    ''' Collects all the information of the current design into a dictionary 
+    in the format create.py is able to parse and output to an XML file. '''
     data = {"canvas": {}, 
             "folds": {"mountain": {}, "valley": {}}, 
             "closed_loop": False, 
@@ -364,7 +534,13 @@ def save_to_json(graph, mountain_folds, valley_folds, faces_to_draw, grounds):
     for vertex, ground in grounds.items():
         if ground: 
             data["grounded_vertices"].append(f"v{list(graph.keys()).index(vertex) + 1}")
+    return data
 
+def save_to_json(graph, mountain_folds, valley_folds, faces_to_draw, grounds):
+    ''' When the user hits the ENTER key, this function saves the design into a Json file. '''
+    data = design_to_dict(graph, mountain_folds, valley_folds, faces_to_draw, grounds)
+    for d in validate_design.validate_design(data):
+        print(validate_design.format_diagnostic(d))
     with open("./designs/design.json", "w") as json_file:
         json.dump(data, json_file, indent=4)
         print(f"Design saved to design.json at {json_file}")
@@ -376,12 +552,40 @@ def get_clicked_joint_type(click_pos):
                 return i
     return None
 
+def toggle_preview(current_preview):
+    ''' Stops the running preview, or compiles the current design and starts simulating it in the background. '''
+    if current_preview is not None:
+        current_preview.stop()
+        return None
+    if not graph:
+        return None
+    new_preview = preview.PreviewSimulation(design_to_dict(graph, mountain_folds, valley_folds, faces_to_draw, grounds))
+    new_preview.start()
+    return new_preview
+
 # Main loop
 running = True
+live_preview = None
+preview_font = pygame.font.Font(None, 24)
+clock = pygame.time.Clock()
+joint_selection_bar = build_joint_selection_bar()
 selected_vertex = None
+panning = False
 
 joint_edit_mode = False
 
+# The grid index is rebuilt when index_dirty is set (deletions), and the cached geometry layer 
+# when geometry_dirty is set (zoom, and edits that change the design all over). Other edits add 
+# to the index and record the canvas points they touched in damaged_points; only the window 
+# regions around those are re-rendered. Panning scrolls the layer by pending_scroll. Only the 
+# regions in dirty_rects are copied to the window, so an idle editor, or a click that only 
+# selects a vertex, redraws nothing.
+index_dirty = True
+geometry_dirty = True
+pending_scroll = [0, 0]
+damaged_points = []
+dirty_rects = []
+
 while running:
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
@@ -390,30 +594,60 @@ while running:
             if event.key == pygame.K_j:
                 joint_edit_mode = not joint_edit_mode
                 print("Edit mode turned on")
+                dirty_rects.append(pygame.Rect(*BAR_POSITION, BAR_WIDTH, BAR_HEIGHT))
+                if selected_vertex:
+                    dirty_rects.append(selected_vertex_rect(selected_vertex))
             if event.key == pygame.K_RETURN:
                 save_to_json(graph, mountain_folds, valley_folds, faces_to_draw, grounds)
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            click_pos = event.pos
+            if event.key == pygame.K_p:
+                live_preview = toggle_preview(live_preview)
+                dirty_rects.append(screen.get_rect())
+            if event.key in (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN):
+                dx = PAN_STEP * ((event.key == pygame.K_LEFT) - (event.key == pygame.K_RIGHT))
+                dy = PAN_STEP * ((event.key == pygame.K_UP) - (event.key == pygame.K_DOWN))
+                pan_by(dx, dy)
+                pending_scroll[0] += dx
+                pending_scroll[1] += dy
+        elif event.type == pygame.MOUSEWHEEL:
+            zoom_at(pygame.mouse.get_pos(), ZOOM_STEP ** event.y)
+            geometry_dirty = True
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 2:
+            panning = True
+        elif event.type == pygame.MOUSEBUTTONUP and event.button == 2:
+            panning = False
+        elif event.type == pygame.MOUSEMOTION and panning:
+            pan_by(*event.rel)
+            pending_scroll[0] += event.rel[0]
+            pending_scroll[1] += event.rel[1]
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button not in (4, 5) and live_preview is None:
+            if index_dirty:
+                # Hit tests go through the grid index, so it has to reflect earlier deletions
+                index_geometry()
+                index_dirty = False
+            click_pos = screen_to_world(event.pos)
             if joint_edit_mode:
                 if selected_vertex:
-                    property_index = get_clicked_joint_type(click_pos)
+                    property_index = get_clicked_joint_type(event.pos)
                     if property_index is not None:
                         toggle_joint_property(selected_vertex, property_index)
+                        damaged_points.append([selected_vertex])
                         # print("JOINTS: ", joints)
                         # print("ACTUATORS: ", actuators)
                         # print("GROUNDS", grounds)
             else:
 
-                clicked_vertex = find_vertex(event.pos)
-                clicked_line = find_line(event.pos, graph)
+                clicked_vertex = find_vertex(click_pos)
+                clicked_line = find_line(click_pos, graph)
                 
                 if not clicked_line:
                     if clicked_vertex:
                         if pygame.key.get_mods() & pygame.KMOD_SHIFT:
+                            damaged_points.append([clicked_vertex] + [n[0] for n in graph[clicked_vertex]])
                             delete_vertex(clicked_vertex)
+                            index_dirty = True
                         elif selected_vertex:
-                            graph[selected_vertex].append([clicked_vertex, 0])
-                            graph[clicked_vertex].append([selected_vertex, 0])
+                            connect_vertices(selected_vertex, clicked_vertex)
+                            damaged_points.append([selected_vertex, clicked_vertex])
                             selected_vertex = None
                         else:
                             selected_vertex = clicked_vertex
@@ -423,35 +657,65 @@ while running:
                             # print("graph", graph)
                             # print("faces: ", faces)
                             # print("clicked in polygon: ", polygon)
-                            faces_to_draw.append(polygon)
+                            add_face_to_draw(polygon)
+                            damaged_points.append(polygon)
                             continue
                             # sorted_face =  sort_points_counterclockwise(polygon)
                             # pygame.draw.polygon(screen, (173, 216, 200) , sorted_face)
-                        aligned_pos = align_vertex(event.pos)
+                        aligned_pos = align_vertex(click_pos)
                         if not find_is_there_nearby_vertex(aligned_pos):
                             graph[aligned_pos] = []
+                            index_vertex(aligned_pos)
+                            damaged_points.append([aligned_pos])
                         joints[aligned_pos] = [False] * 6
                 else:
+                    # find_line changed the fold type of the line and cleared the selected faces
+                    geometry_dirty = True
                     if pygame.key.get_mods() & pygame.KMOD_SHIFT:
                             delete_line(clicked_line)
+                            index_dirty = True
                     if clicked_vertex:
                         if selected_vertex:
-                            graph[selected_vertex].append([clicked_vertex, 0])
-                            graph[clicked_vertex].append([selected_vertex, 0])
+                            connect_vertices(selected_vertex, clicked_vertex)
                             selected_vertex = None
                         else:
                             selected_vertex = clicked_vertex
     
-    screen.fill(BACKGROUND_COLOR)
-    draw_vertices()
-    draw_lines()
-    draw_faces()
-    if joint_edit_mode:
-        draw_joint_selection_bar()
-        if selected_vertex:
-            # Highlight the selected vertex
-            pygame.draw.circle(screen, (255, 255, 100), selected_vertex, VERTEX_RADIUS + 2, 2)
-    pygame.display.flip()
-
+    if live_preview is not None:
+        preview.draw_preview(screen, live_preview, preview_font, world_to_screen)
+        pygame.display.flip()
+        clock.tick(preview.PREVIEW_FPS)
+        continue
+    if index_dirty:
+        index_geometry()
+        index_dirty = False
+    if geometry_dirty:
+        rebuild_geometry_layer()
+        geometry_dirty = False
+        dirty_rects = [screen.get_rect()]
+    else:
+        if pending_scroll != [0, 0]:
+            scroll_geometry_layer(*pending_scroll)
+            dirty_rects = [screen.get_rect()]
+        for points in damaged_points:
+            rect = damaged_rect(points)
+            render_geometry(rect)
+            dirty_rects.append(rect)
+    pending_scroll = [0, 0]
+    damaged_points = []
+    if dirty_rects:
+        for rect in dirty_rects:
+            screen.blit(geometry_layer, rect, rect)
+        if joint_edit_mode:
+            draw_joint_selection_bar()
+            if selected_vertex:
+                # Highlight the selected vertex
+                pygame.draw.circle(screen, (255, 255, 100), world_to_screen(selected_vertex), max(1, VERTEX_RADIUS * view_zoom) + 2, 2)
+        pygame.display.update(dirty_rects)
+        dirty_rects = []
+    clock.tick(FPS)
+
+if live_preview is not None:
+    live_preview.stop(timeout=1.0)
 pygame.quit()
 sys.exit()
\ No newline at end of file
@@ -0,0 +1,243 @@
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+
+import mujoco
+import numpy as np
+import pygame
+
+import create
+import dof_reduction
+import fold_presolver
+import validate_design
+
+SCENE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "XML_files", "scene.xml")
+CANVAS_SCALE = 1000.0  # save_to_json stores pixel coordinates divided by 1000
+VIEW_ELEVATION = math.pi / 4  # how strongly height above the sheet lifts a vertex up the screen
+PREVIEW_BACKGROUND = (235, 240, 245)
+PREVIEW_FACE_COLOR = (173, 216, 200)
+PREVIEW_EDGE_COLOR = (0, 0, 255)
+PREVIEW_VERTEX_COLOR = (255, 0, 0)
+PREVIEW_TEXT_COLOR = (0, 0, 0)
+READ_RETRIES = 4
+PREVIEW_FPS = 60
+FIT_MARGIN = 40  # window pixels left around a design fitted to the window
+
+
+class VertexBuffer:
+    ''' Double buffer of vertex positions shared by the simulation and render loops.
+    The simulation writes into the back slot and publishes it by bumping a version counter,
+    which also selects the front slot. Readers copy the front slot and retry if a publish
+    happened meanwhile, so neither loop ever waits on a lock. '''
+
+    def __init__(self, positions):
+        self.slots = [np.array(positions, dtype=float), np.array(positions, dtype=float)]
+        self.version = 0
+        self.last_read = self.slots[0].copy()
+
+    def write(self, positions):
+        ''' Called from the simulation thread only. '''
+        back = (self.version + 1) & 1
+        np.copyto(self.slots[back], positions)
+        self.version += 1
+
+    def read(self):
+        ''' Returns a private copy of the latest published positions. '''
+        for _ in range(READ_RETRIES):
+            version = self.version
+            snapshot = self.slots[version & 1].copy()
+            if self.version == version:
+                self.last_read = snapshot
+                break
+        return self.last_read
+
+
+def compile_design(data, name="preview", reduce=True):
+    ''' Builds the MJCF for a design dictionary the same way create.py does and compiles it in memory.
+    With reduce=False the DOF reduction pass is skipped and every flagged joint is emitted. '''
+    vertices, edges, grounds, joints, actuators = create.design_to_mjcf_inputs(data)
+    dof_plan = dof_reduction.reduce_dofs(vertices, edges, grounds, joints, actuators) if reduce else None
+    keyframe_positions = None
+    if data.get("fold_angles"):
+        keyframe_positions, _ = fold_presolver.solve_design(data, dof_plan)
+    xml_str = create.get_mjcf_flex(name, vertices, edges, grounds, joints, actuators,
+                                   keyframe_positions=keyframe_positions, dof_plan=dof_plan)
+    with open(SCENE_FILE, "rb") as f:
+        assets = {"scene.xml": f.read()}
+    try:
+        return mujoco.MjModel.from_xml_string(xml_str, assets)
+    except ValueError as e:
+        if "plugin" not in str(e):
+            raise
+        # Newer MuJoCo releases no longer ship the elasticity plugin. The generated model only
+        # declares it and never instances it, so the preview can drop the declaration.
+        xml_str = re.sub(r"<extension>.*?</extension>", "", xml_str, flags=re.S)
+        return mujoco.MjModel.from_xml_string(xml_str, assets)
+
+
+class PreviewSimulation:
+    ''' Compiles a design and steps it in a background thread at the model's own timestep.
+    The editor only ever calls read(), which never blocks on the simulation. '''
+
+    def __init__(self, data, realtime=True):
+        self.data = data
+        self.realtime = realtime
+        self.vertex_names = list(data["canvas"].keys())
+        self.buffer = None
+        self.rest_z = None
+        self.error = None
+        self.sim_time = 0.0
+        self.steps = 0
+        self.body_indices = []
+        for body_vertices in data["bodies"].values():
+            indices = [self.vertex_names.index(v) for v in body_vertices if v in self.vertex_names]
+            self.body_indices.append(self.sort_counterclockwise(indices))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sort_counterclockwise(self, indices):
+        ''' Orders a body's vertices around their centroid on the flat sheet, so the outline stays
+        consistent while the sheet folds. '''
+        points = [self.data["canvas"][self.vertex_names[i]] for i in indices]
+        if not points:
+            return indices
+        cx = sum(p[0] for p in points) / len(points)
+        cy = sum(p[1] for p in points) / len(points)
+        return [i for _, i in sorted(zip(points, indices), key=lambda pi: math.atan2(pi[0][1] - cy, pi[0][0] - cx))]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="origami-preview", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        ''' Asks the simulation thread to finish. Returns at once unless a timeout is given, as a compile
+        in progress cannot be interrupted; the thread is a daemon and exits once the compile is done. '''
+        self._stop.set()
+        if timeout is not None and self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def read(self):
+        ''' Latest vertex positions, or None while the design is still compiling. '''
+        if self.buffer is None:
+            return None
+        return self.buffer.read()
+
+    def _run(self):
+        errors = [d for d in validate_design.validate_design(self.data) if d["level"] == validate_design.ERROR]
+        if errors:
+            self.error = validate_design.format_diagnostic(errors[0])
+            if len(errors) > 1:
+                self.error += f" (and {len(errors) - 1} more)"
+            return
+        try:
+            model = compile_design(self.data)
+        except Exception as e:
+            self.error = str(e)
+            return
+        if self._stop.is_set():
+            return
+        sim = mujoco.MjData(model)
+        ids = [mujoco.mj_name2id(model, mujoco.mjtObj.mjOBJ_BODY, name) for name in self.vertex_names]
+        if model.nkey:
+            # Start from the pre-solved fold state
+            mujoco.mj_resetDataKeyframe(model, sim, 0)
+        mujoco.mj_forward(model, sim)
+        self.rest_z = model.body_pos[ids, 2].copy()
+        self.buffer = VertexBuffer(sim.xpos[ids])
+        dt = model.opt.timestep
+        wall_start = time.perf_counter()
+        while not self._stop.is_set():
+            mujoco.mj_step(model, sim)
+            self.buffer.write(sim.xpos[ids])
+            self.steps += 1
+            self.sim_time = sim.time
+            if self.realtime:
+                ahead = sim.time - (time.perf_counter() - wall_start)
+                if ahead > dt:
+                    self._stop.wait(ahead)
+                elif ahead < -0.25:
+                    # Too slow to keep up; drop the backlog instead of spiralling.
+                    wall_start = time.perf_counter() - sim.time
+
+
+def project(positions, rest_z, elevation=VIEW_ELEVATION):
+    ''' Projects simulated vertex positions back onto the editor canvas. Height above the flat
+    sheet lifts a vertex up the screen by sin(elevation). '''
+    lift = (positions[:, 2] - rest_z) * math.sin(elevation)
+    xs = positions[:, 0] * CANVAS_SCALE
+    ys = (positions[:, 1] - lift) * CANVAS_SCALE
+    return np.stack((xs, ys), axis=1)
+
+
+def fit_to_window(data, size, margin=FIT_MARGIN):
+    ''' A canvas to window transform that shows the whole flat design centred in a window of the given size.
+    Used when the preview runs without the editor, whose own view transform is used otherwise. '''
+    canvas = np.array(list(data["canvas"].values()), dtype=float).reshape(-1, 2) * CANVAS_SCALE
+    if len(canvas) == 0:
+        return lambda pos: pos
+    low, high = canvas.min(axis=0), canvas.max(axis=0)
+    extent = np.maximum(high - low, 1e-9)
+    scale = min((size[0] - 2 * margin) / extent[0], (size[1] - 2 * margin) / extent[1])
+    centre = (low + high) / 2
+    return lambda pos: (size[0] / 2 + (pos[0] - centre[0]) * scale, size[1] / 2 + (pos[1] - centre[1]) * scale)
+
+
+def screen_points(preview, positions, to_screen=None, size=(800, 600)):
+    ''' Window positions of the simulated vertices, through to_screen (a canvas to window function,
+    such as the editor's world_to_screen) or fitted to a window of the given size. '''
+    if to_screen is None:
+        to_screen = fit_to_window(preview.data, size)
+    return [to_screen(p) for p in project(positions, preview.rest_z)]
+
+
+def draw_preview(screen, preview, font, to_screen=None):
+    ''' Draws the latest frame of a running preview on the given surface. Canvas positions go through
+    to_screen, or the design is fitted to the surface when there is none. '''
+    screen.fill(PREVIEW_BACKGROUND)
+    positions = preview.read()
+    if positions is None:
+        message = f"Preview failed: {preview.error}" if preview.error else "Compiling preview..."
+        screen.blit(font.render(message, True, PREVIEW_TEXT_COLOR), (10, 10))
+        return
+    points = screen_points(preview, positions, to_screen, screen.get_size())
+    for indices in preview.body_indices:
+        if len(indices) < 3:
+            continue
+        polygon = [points[i] for i in indices]
+        pygame.draw.polygon(screen, PREVIEW_FACE_COLOR, polygon)
+        pygame.draw.polygon(screen, PREVIEW_EDGE_COLOR, polygon, 2)
+    for x, y in points:
+        pygame.draw.circle(screen, PREVIEW_VERTEX_COLOR, (x, y), 4)
+    status = f"Preview  t = {preview.sim_time:.2f} s  ({preview.steps} steps)   P: back to editor"
+    screen.blit(font.render(status, True, PREVIEW_TEXT_COLOR), (10, 10))
+
+
+if __name__ == '__main__':
+    # Preview a saved design without the editor: python preview.py [design.json]
+    path = sys.argv[1] if len(sys.argv) > 1 else './designs/design.json'
+    with open(path) as f:
+        data = json.load(f)
+    pygame.init()
+    screen = pygame.display.set_mode((800, 600))
+    pygame.display.set_caption("Origami Preview")
+    font = pygame.font.Font(None, 24)
+    clock = pygame.time.Clock()
+    preview = PreviewSimulation(data)
+    preview.start()
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+        draw_preview(screen, preview, font)
+        pygame.display.flip()
+        clock.tick(PREVIEW_FPS)
+    preview.stop()
+    pygame.quit()
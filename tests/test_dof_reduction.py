@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mujoco
+import numpy as np
+
+import create
+import dof_reduction
+import preview
+
+DESIGNS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "designs")
+
+
+def load(name):
+    with open(os.path.join(DESIGNS, name)) as f:
+        return json.load(f)
+
+
+def plan_for(data):
+    return dof_reduction.reduce_dofs(*create.design_to_mjcf_inputs(data))
+
+
+def settle(data, reduce, steps=3000):
+    model = preview.compile_design(data, reduce=reduce)
+    sim = mujoco.MjData(model)
+    ids = [mujoco.mj_name2id(model, mujoco.mjtObj.mjOBJ_BODY, name) for name in data["canvas"]]
+    for _ in range(steps):
+        mujoco.mj_step(model, sim)
+    return model, sim.xpos[ids].copy()
+
+
+def test_tilt_r_keeps_the_joints_its_vertices_sag_on():
+    data = load("tilt_R.json")
+    plan = plan_for(data)
+    assert plan["removed"] == {}
+    assert plan["dofs_after"] == plan["dofs_before"] == 5
+    assert plan["joints"][5] == [0, 2]  # v6
+    assert plan["joints"][8] == [0, 2]  # v9
+    assert plan["joints"][11] == [2]  # v12
+    full_model, full = settle(data, reduce=False)
+    reduced_model, reduced = settle(data, reduce=True)
+    assert reduced_model.nv == full_model.nv
+    np.testing.assert_allclose(reduced, full, atol=1e-9)
+
+
+def test_contraction_keeps_every_joint():
+    plan = plan_for(load("contraction.json"))
+    assert plan["removed"] == {}
+    assert plan["dofs_after"] == plan["dofs_before"] == 24
+
+
+def test_in_plane_joints_are_removed_when_the_vertex_cannot_sag():
+    data = load("contraction.json")
+    for v in ("v14", "v15"):
+        data["joints"][v] = [True, True, False, False, False, False]
+    plan = plan_for(data)
+    # v15 is only held once v14 is, through its edge to it
+    assert set(plan["removed"]) == {"v14", "v15"}
+    assert "v14" in plan["removed"]["v15"][1]
+    assert plan["joints"][13] == plan["joints"][14] == []
+    assert plan["dofs_after"] == plan["dofs_before"] - 4
+
+
+def test_actuated_and_grounded_vertices():
+    data = load("tilt_R.json")
+    data["actuators"] = [["v6", 2], ["v1", 0]]
+    data["grounded_vertices"] = ["v1"]
+    plan = plan_for(data)
+    assert plan["actuators"] == [["v6", 2]]
+    assert plan["dropped_actuators"] == [("v1", 0, "vertex is grounded")]
+    assert plan["joints"][0] == []
+    assert plan["joints"][5] == [0, 2]
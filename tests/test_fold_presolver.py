@@ -0,0 +1,73 @@
+import itertools
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mujoco
+import numpy as np
+import pytest
+
+import create
+import dof_reduction
+import fold_presolver
+import parse_input_with_bodies
+import preview
+
+DESIGN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "designs", "twist.json")
+
+
+def folded_twist(angle=20.0):
+    with open(DESIGN) as f:
+        data = json.load(f)
+    data["fold_angles"] = {fold: angle for kind in ("mountain", "valley") for fold in data["folds"][kind]}
+    return data
+
+
+def test_rigid_panels_keep_their_edge_lengths():
+    data = folded_twist()
+    folded, info = fold_presolver.solve_design(data)
+    assert info["residual"] < 1e-6
+    assert np.abs(folded[:, 2] - 1).max() > 0.1
+    vertices, _ = parse_input_with_bodies.find_and_order_vertices(data)
+    names = list(vertices.keys())
+    flat = np.array([[x, y, 1.0] for x, y in vertices.values()])
+    for body_vertices in data["bodies"].values():
+        for a, b in itertools.combinations([names.index(v) for v in body_vertices], 2):
+            assert np.linalg.norm(folded[a] - folded[b]) == pytest.approx(np.linalg.norm(flat[a] - flat[b]), abs=1e-6)
+
+
+def test_keyframe_reproduces_the_solved_positions():
+    data = folded_twist()
+    vertices, edges, grounds, joints, actuators = create.design_to_mjcf_inputs(data)
+    plan = dof_reduction.reduce_dofs(vertices, edges, grounds, joints, actuators)
+    folded, _ = fold_presolver.solve_design(data, plan)
+    model = preview.compile_design(data)
+    sim = mujoco.MjData(model)
+    mujoco.mj_resetDataKeyframe(model, sim, 0)
+    mujoco.mj_forward(model, sim)
+    ids = [mujoco.mj_name2id(model, mujoco.mjtObj.mjOBJ_BODY, name) for name in data["canvas"]]
+    # get_mjcf_flex lifts every vertex body 5 mm above the sheet
+    np.testing.assert_allclose(sim.xpos[ids], folded + [0, 0, 0.005], atol=1e-5)
+
+
+def test_actuated_axes_are_free_to_fold():
+    data = folded_twist()
+    for i in range(5, 13):
+        data["joints"][f"v{i}"] = [False] * 6
+        data["actuators"] += [[f"v{i}", axis] for axis in range(3)]
+    folded, info = fold_presolver.solve_design(data)
+    assert np.abs(folded[:, 2] - 1).max() > 0.1
+    assert info["unreachable"] == {}
+
+
+def test_unreachable_and_unknown_angles_are_reported():
+    data = folded_twist()
+    data["fold_angles"]["no_such_fold"] = 10
+    for i in range(5, 13):
+        data["joints"][f"v{i}"] = [False] * 6
+    folded, info = fold_presolver.solve_design(data)
+    assert np.abs(folded[:, 2] - 1).max() < 1e-6
+    assert set(info["unreachable"]) == {fold for kind in ("mountain", "valley") for fold in data["folds"][kind]}
+    assert info["unknown"] == ["no_such_fold"]
@@ -0,0 +1,159 @@
+import json
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pygame
+import pytest
+
+import preview
+
+DESIGNS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "designs")
+DESIGN = os.path.join(DESIGNS, "twist.json")
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_preview_runs_headless():
+    with open(DESIGN) as f:
+        data = json.load(f)
+    pygame.init()
+    try:
+        screen = pygame.display.set_mode((800, 600))
+        font = pygame.font.Font(None, 24)
+        sim = preview.PreviewSimulation(data)
+        sim.start()
+        try:
+            assert wait_for(lambda: sim.read() is not None or sim.error is not None)
+            assert sim.error is None
+            positions = sim.read()
+            assert positions.shape == (len(data["canvas"]), 3)
+            steps = sim.steps
+            for _ in range(10):
+                preview.draw_preview(screen, sim, font)
+                pygame.display.flip()
+                time.sleep(0.01)
+            assert face_pixels(screen) > 0
+            assert wait_for(lambda: sim.steps > steps)
+        finally:
+            sim.stop(timeout=5.0)
+        assert not sim.is_running()
+    finally:
+        pygame.quit()
+
+
+def face_pixels(surface):
+    pixels = pygame.surfarray.array3d(surface)
+    return int(np.all(pixels == preview.PREVIEW_FACE_COLOR, axis=2).sum())
+
+
+@pytest.mark.parametrize("name", sorted(os.listdir(DESIGNS)))
+def test_preview_fits_design_to_window(name):
+    with open(os.path.join(DESIGNS, name)) as f:
+        data = json.load(f)
+    sim = preview.PreviewSimulation(data)
+    sim.start()
+    try:
+        assert wait_for(lambda: sim.read() is not None or sim.error is not None)
+        assert sim.error is None
+    finally:
+        sim.stop(timeout=5.0)
+    points = np.array(preview.screen_points(sim, sim.read(), size=(800, 600)))
+    assert np.all(points >= 0) and np.all(points <= (800, 600))
+    pygame.font.init()
+    surface = pygame.Surface((800, 600))
+    preview.draw_preview(surface, sim, pygame.font.Font(None, 24))
+    assert face_pixels(surface) > 0
+
+
+def test_preview_uses_the_editor_view_transform():
+    with open(DESIGN) as f:
+        data = json.load(f)
+    sim = preview.PreviewSimulation(data)
+    sim.rest_z = np.ones(len(data["canvas"]))
+    positions = np.array([[x, y, 1.0] for x, y in data["canvas"].values()])
+    points = preview.screen_points(sim, positions, lambda pos: ((pos[0] - 1000) * 0.5, (pos[1] - 500) * 0.5))
+    x, y = data["canvas"]["v1"]
+    assert points[0] == pytest.approx(((x * 1000 - 1000) * 0.5, (y * 1000 - 500) * 0.5))
+
+
+class RacingSlot:
+    ''' Stands in for a buffer slot; the first copy publishes a new frame, as the simulation thread would. '''
+
+    def __init__(self, buffer, stale, fresh):
+        self.buffer = buffer
+        self.stale = stale
+        self.fresh = fresh
+        self.copies = 0
+
+    def copy(self):
+        self.copies += 1
+        if self.copies == 1:
+            self.buffer.write(self.fresh)
+        return self.stale.copy()
+
+
+def test_vertex_buffer_read_retries_after_concurrent_write():
+    stale = np.zeros((2, 3))
+    fresh = np.ones((2, 3))
+    buffer = preview.VertexBuffer(stale)
+    slot = RacingSlot(buffer, stale, fresh)
+    buffer.slots[0] = slot
+    result = buffer.read()
+    assert slot.copies == 1
+    assert buffer.version == 1
+    np.testing.assert_array_equal(result, fresh)
+
+
+def test_vertex_buffer_read_keeps_last_frame_when_writer_never_pauses():
+    buffer = preview.VertexBuffer(np.zeros((1, 3)))
+    good = buffer.read()
+
+    class AlwaysRacing:
+        def copy(self):
+            buffer.version += 2  # a publish lands during every copy, front slot unchanged
+            return np.full((1, 3), -1.0)
+
+    buffer.slots[0] = AlwaysRacing()
+    result = buffer.read()
+    np.testing.assert_array_equal(result, good)
+
+
+def test_stop_does_not_wait_for_a_compile(monkeypatch):
+    with open(DESIGN) as f:
+        data = json.load(f)
+    compiling = threading.Event()
+    release = threading.Event()
+    compile_design = preview.compile_design
+
+    def slow_compile(design):
+        compiling.set()
+        release.wait(5.0)
+        return compile_design(design)
+
+    monkeypatch.setattr(preview, "compile_design", slow_compile)
+    sim = preview.PreviewSimulation(data)
+    sim.start()
+    try:
+        assert compiling.wait(5.0)
+        start = time.perf_counter()
+        sim.stop()
+        assert time.perf_counter() - start < 0.05
+        assert sim.is_running()
+    finally:
+        release.set()
+        sim.stop(timeout=5.0)
+    assert not sim.is_running()
+    assert sim.read() is None
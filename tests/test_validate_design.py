@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import validate_design
+
+DESIGN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "designs", "twist.json")
+
+
+def load():
+    with open(DESIGN) as f:
+        return json.load(f)
+
+
+def codes(data):
+    return [(d["level"], d["code"]) for d in validate_design.validate_design(data)]
+
+
+def test_saved_design_is_clean():
+    assert codes(load()) == []
+
+
+def test_crossing_edges():
+    data = load()
+    # A body spanning the two triangles of the central square crosses its folds
+    data["bodies"]["body_x"] = ["v5", "v9", "v8", "v6"]
+    diagnostics = validate_design.validate_design(data)
+    assert any(d["code"] == "crossing_edges" and d["level"] == validate_design.ERROR for d in diagnostics)
+
+
+def test_duplicate_vertices():
+    data = load()
+    x, y = data["canvas"]["v1"]
+    data["canvas"]["v13"] = [x + 1e-4, y]
+    diagnostics = [d for d in validate_design.validate_design(data) if d["code"] == "duplicate_vertices"]
+    assert [d["vertices"] for d in diagnostics] == [["v1", "v13"]]
+
+
+def test_duplicates_on_a_shared_x_are_found_in_linear_time():
+    names = [f"v{i}" for i in range(8001)]
+    points = np.zeros((8001, 2))
+    points[:8000, 1] = np.arange(8000) * 0.01
+    points[8000, 1] = 0.0105
+    diagnostics = validate_design.check_duplicate_vertices(names, points, 1e-3)
+    assert [d["vertices"] for d in diagnostics] == [["v1", "v8000"]]
+
+
+def test_unshared_fold():
+    data = load()
+    fold = next(iter(data["folds"]["mountain"]))
+    a, b = data["folds"]["mountain"][fold]
+    for body, body_vertices in list(data["bodies"].items()):
+        if a in body_vertices and b in body_vertices:
+            del data["bodies"][body]
+            break
+    assert (validate_design.ERROR, "unshared_fold") in codes(data)
+
+
+def test_fold_with_one_end_is_reported_not_raised():
+    data = load()
+    data["folds"]["mountain"]["m1"] = {"v1": [0, 0]}
+    assert codes(data) == [(validate_design.ERROR, "degenerate_fold")]
+
+
+def test_fold_end_missing_from_canvas_is_an_unknown_vertex():
+    data = load()
+    data["folds"]["mountain"]["m1"] = {"v1": [0, 0], "v99": data["canvas"]["v2"]}
+    assert codes(data) == [(validate_design.ERROR, "unknown_vertex")]
+
+
+def test_body_sides_follow_the_sorted_outline():
+    data = load()
+    body = next(body for body, body_vertices in data["bodies"].items() if len(body_vertices) == 4)
+    a, b, c, d = data["bodies"][body]
+    data["bodies"][body] = [a, c, d, b]
+    assert codes(data) == [(validate_design.WARNING, "body_not_star_shaped")]
+
+
+def test_malformed_structure_is_reported_not_raised():
+    data = load()
+    data["actuators"].append(["v5"])
+    assert codes(data) == [(validate_design.ERROR, "bad_structure")]
+    data = load()
+    del data["folds"]["valley"]
+    assert codes(data) == [(validate_design.ERROR, "bad_structure")]
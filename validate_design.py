@@ -0,0 +1,388 @@
+import itertools
+import json
+import sys
+
+import numpy as np
+
+# Vertices closer than this (in design units, the GUI saves pixels / 1000) are treated as the same point.
+DEFAULT_TOLERANCE = 1e-3
+
+ERROR = "error"
+WARNING = "warning"
+
+
+def diagnostic(level, code, message, **details):
+    ''' A single finding of the validator. Kept as a plain dictionary so it can be printed,
+    dumped to JSON or shown in the GUI without any conversion. '''
+    entry = {"level": level, "code": code, "message": message}
+    entry.update(details)
+    return entry
+
+
+def has_errors(diagnostics):
+    return any(d["level"] == ERROR for d in diagnostics)
+
+
+def format_diagnostic(d):
+    return f"{d['level'].upper()} [{d['code']}] {d['message']}"
+
+
+def is_position(value):
+    ''' A canvas or fold entry create.py can read: at least an x and a y number. '''
+    return (isinstance(value, (list, tuple)) and len(value) >= 2
+            and all(isinstance(c, (int, float)) and not isinstance(c, bool) for c in value[:2]))
+
+
+def check_structure(data):
+    ''' The design has to have the shape create.py unpacks: a canvas of positions, bodies as vertex lists,
+    mountain and valley folds mapping their two end vertices to positions, joints as flag lists,
+    actuators as [vertex, axis] pairs and a list of grounded vertices. Runs before everything else. '''
+    diagnostics = []
+
+    def problem(message):
+        diagnostics.append(diagnostic(ERROR, "bad_structure", message))
+
+    if not isinstance(data, dict):
+        problem("the design is not a JSON object")
+        return diagnostics
+    expected = {"canvas": dict, "bodies": dict, "folds": dict, "joints": dict, "actuators": list, "grounded_vertices": list}
+    for key, kind in expected.items():
+        if not isinstance(data.get(key), kind):
+            problem(f"{key} is missing or not a {'list' if kind is list else 'mapping'}")
+    if diagnostics:
+        return diagnostics
+    for body, body_vertices in data["bodies"].items():
+        if not isinstance(body_vertices, list) or not all(isinstance(v, str) for v in body_vertices):
+            problem(f"{body} is not a list of vertex names")
+    for kind in ("mountain", "valley"):
+        if not isinstance(data["folds"].get(kind), dict):
+            problem(f"folds has no {kind} mapping")
+            continue
+        for fold_name, ends in data["folds"][kind].items():
+            if not isinstance(ends, dict) or not all(is_position(pos) for pos in ends.values()):
+                problem(f"{fold_name} does not map its end vertices to positions")
+    for v, flags in data["joints"].items():
+        if not isinstance(flags, list) or len(flags) < 3:
+            problem(f"joints entry for {v} is not a list of flags")
+    for entry in data["actuators"]:
+        if not (isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], str)):
+            problem(f"actuator {entry!r} is not a [vertex, axis] pair")
+    if not all(isinstance(v, str) for v in data["grounded_vertices"]):
+        problem("grounded_vertices is not a list of vertex names")
+    return diagnostics
+
+
+def collect_vertices(data):
+    ''' Returns the vertex names and an (n, 2) array of their positions, in canvas order, which is
+    the order create.py numbers them in. Entries without a usable position are left out;
+    check_references reports them. '''
+    names = [v for v, pos in data.get("canvas", {}).items() if is_position(pos)]
+    points = np.array([data["canvas"][v][:2] for v in names], dtype=float).reshape(-1, 2)
+    return names, points
+
+
+def collect_folds(data):
+    ''' Returns (fold name, vertex a, vertex b) for every mountain and valley fold.
+    A fold listing fewer than two vertices gets None for the missing ends. '''
+    folds = []
+    for kind in ("mountain", "valley"):
+        for fold_name, ends in data.get("folds", {}).get(kind, {}).items():
+            names = list(ends.keys()) if isinstance(ends, dict) else []
+            folds.append((fold_name, names[0] if names else None, names[1] if len(names) > 1 else None))
+    return folds
+
+
+def body_outlines(bodies, index, points):
+    ''' The outlines create_bodies triangulates: each body's vertices sorted counterclockwise around
+    their centroid. All bodies are handled at once; the result is one flat array of vertex indices
+    plus the start and length of each body's run in it. '''
+    counts = np.array([len(body_vertices) for body_vertices in bodies], dtype=int)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(int)
+    ids = np.array([index[v] for body_vertices in bodies for v in body_vertices], dtype=int)
+    owner = np.repeat(np.arange(len(bodies)), counts)
+    centroids = np.add.reduceat(points[ids], starts, axis=0) / counts[:, None]
+    offsets = points[ids] - centroids[owner]
+    angles = np.arctan2(offsets[:, 1], offsets[:, 0])
+    order = np.lexsort((angles, owner))
+    return ids[order], starts, counts
+
+def body_sides(data, names, index, points):
+    ''' The sides of every body as create_bodies builds it, from its outline sorted around the centroid.
+    Bodies with unknown vertices or fewer than three distinct ones have no sides. '''
+    body_names = [body for body, body_vertices in data["bodies"].items()
+                  if all(v in index for v in body_vertices) and len(set(body_vertices)) >= 3]
+    if not body_names:
+        return {}
+    outline, starts, counts = body_outlines([data["bodies"][body] for body in body_names], index, points)
+    sides = {}
+    for body, start, count in zip(body_names, starts, counts):
+        ring = [names[i] for i in outline[start:start + count]]
+        sides[body] = [(a, b) for a, b in zip(ring, ring[1:] + ring[:1]) if a != b]
+    return sides
+
+
+def check_references(data, index):
+    ''' Every vertex named by a body, fold, joint, actuator or ground must be on the canvas, and every
+    canvas entry needs a position. Runs before the geometric checks, which only look at the
+    vertices in index. '''
+    diagnostics = []
+    canvas = data.get("canvas", {})
+    for v, pos in canvas.items():
+        if v not in index:
+            diagnostics.append(diagnostic(ERROR, "bad_position", f"{v} has position {pos!r}, expected [x, y]", vertices=[v]))
+    for body, body_vertices in data.get("bodies", {}).items():
+        for v in body_vertices:
+            if v not in canvas:
+                diagnostics.append(diagnostic(ERROR, "unknown_vertex", f"{body} uses unknown vertex {v}", body=body, vertices=[v]))
+    for fold_name, a, b in collect_folds(data):
+        if a is None or b is None or a == b:
+            diagnostics.append(diagnostic(ERROR, "degenerate_fold", f"{fold_name} does not join two distinct vertices", fold=fold_name))
+        for v in (a, b):
+            if v is not None and v not in canvas:
+                diagnostics.append(diagnostic(ERROR, "unknown_vertex", f"{fold_name} ends at unknown vertex {v}", fold=fold_name, vertices=[v]))
+    for v in data.get("joints", {}):
+        if v not in canvas:
+            diagnostics.append(diagnostic(WARNING, "unknown_vertex", f"joints lists unknown vertex {v}", vertices=[v]))
+    for v, axis in data.get("actuators", []):
+        if v not in canvas:
+            diagnostics.append(diagnostic(ERROR, "unknown_vertex", f"actuator on unknown vertex {v}", vertices=[v]))
+        elif axis not in (0, 1, 2):
+            diagnostics.append(diagnostic(ERROR, "bad_actuator", f"actuator on {v} has axis {axis}, expected 0, 1 or 2", vertices=[v]))
+        elif v in data.get("grounded_vertices", []):
+            diagnostics.append(diagnostic(WARNING, "actuated_ground", f"{v} is grounded but also actuated", vertices=[v]))
+    for v in data.get("grounded_vertices", []):
+        if v not in canvas:
+            diagnostics.append(diagnostic(ERROR, "unknown_vertex", f"grounded_vertices lists unknown vertex {v}", vertices=[v]))
+    return diagnostics
+
+
+def check_duplicate_vertices(names, points, tolerance):
+    ''' Finds vertices closer than tolerance. Points are hashed into a grid of tolerance sized cells,
+    so only points in the same or a neighbouring cell are ever measured. '''
+    diagnostics = []
+    if len(points) < 2:
+        return diagnostics
+    cells = np.floor(points / tolerance).astype(np.int64)
+    grid = {}
+    for i, cell in enumerate(map(tuple, cells)):
+        grid.setdefault(cell, []).append(i)
+    pairs = []
+    for (cx, cy), members in grid.items():
+        pairs += itertools.combinations(members, 2)
+        # Each pair of neighbouring cells is visited from one side only
+        for dx, dy in ((1, -1), (1, 0), (1, 1), (0, 1)):
+            for j in grid.get((cx + dx, cy + dy), ()):
+                pairs += [(i, j) for i in members]
+    for i, j in sorted(tuple(sorted(pair)) for pair in pairs):
+        distance = float(np.hypot(*(points[j] - points[i])))
+        if distance <= tolerance:
+            a, b = names[i], names[j]
+            diagnostics.append(diagnostic(ERROR, "duplicate_vertices", f"{a} and {b} are {distance:.2g} apart",
+                                          vertices=[a, b], distance=distance))
+    return diagnostics
+
+
+def check_bodies(data, names, index, points, tolerance):
+    ''' Checks that each body outline is a proper polygon once create_bodies has sorted it. '''
+    diagnostics = []
+    body_names = []
+    for body, body_vertices in data.get("bodies", {}).items():
+        if any(v not in index for v in body_vertices):
+            continue
+        if len(set(body_vertices)) < 3:
+            diagnostics.append(diagnostic(ERROR, "degenerate_body", f"{body} has fewer than three distinct vertices", body=body))
+            continue
+        body_names.append(body)
+    if not body_names:
+        return diagnostics
+    outline, starts, counts = body_outlines([data["bodies"][body] for body in body_names], index, points)
+    owner = np.repeat(np.arange(len(body_names)), counts)
+    position = np.arange(len(outline)) - starts[owner]
+    polygon = points[outline]
+    following = polygon[starts[owner] + (position + 1) % counts[owner]]
+    preceding = polygon[starts[owner] + (position - 1) % counts[owner]]
+    areas = 0.5 * np.add.reduceat(polygon[:, 0] * following[:, 1] - following[:, 0] * polygon[:, 1], starts)
+    degenerate = np.abs(areas) <= tolerance * tolerance
+    for i in np.nonzero(degenerate)[0]:
+        diagnostics.append(diagnostic(ERROR, "degenerate_body", f"{body_names[i]} has zero area", body=body_names[i]))
+    # Collinear neighbours are what offset_colinear tries to patch by moving the vertex.
+    edge_in = polygon - preceding
+    edge_out = following - polygon
+    cross = edge_in[:, 0] * edge_out[:, 1] - edge_in[:, 1] * edge_out[:, 0]
+    scale = np.hypot(*edge_in.T) * np.hypot(*edge_out.T)
+    collinear = (np.abs(cross) <= tolerance * np.maximum(scale, tolerance)) & ~degenerate[owner]
+    for i in np.nonzero(collinear)[0]:
+        body, v = body_names[owner[i]], names[outline[i]]
+        diagnostics.append(diagnostic(WARNING, "collinear_vertex",
+                                      f"{v} lies on a straight side of {body}; create.py will shift it to triangulate",
+                                      body=body, vertices=[v]))
+    # The sorted outline must visit the vertices in the order the body lists them, otherwise
+    # sorting by angle changes the shape of the body.
+    for b, body in enumerate(body_names):
+        if degenerate[b]:
+            continue
+        sorted_ids = outline[starts[b]:starts[b] + counts[b]].tolist()
+        given = [index[v] for v in data["bodies"][body]]
+        start = given.index(sorted_ids[0])
+        rotated = given[start:] + given[:start]
+        if rotated != sorted_ids and [rotated[0]] + rotated[:0:-1] != sorted_ids:
+            diagnostics.append(diagnostic(WARNING, "body_not_star_shaped",
+                                          f"{body} changes shape when its vertices are sorted around the centroid",
+                                          body=body))
+    return diagnostics
+
+
+def check_folds(data, sides_of_bodies):
+    ''' Each fold has to be a side of exactly two bodies, one on either side of the crease. '''
+    diagnostics = []
+    sides = {}
+    for body, body_sides in sides_of_bodies.items():
+        for a, b in body_sides:
+            sides.setdefault(frozenset((a, b)), []).append(body)
+    for fold_name, a, b in collect_folds(data):
+        if a is None or b is None or a == b:
+            continue
+        bodies = sides.get(frozenset((a, b)), [])
+        if len(bodies) < 2:
+            diagnostics.append(diagnostic(ERROR, "unshared_fold",
+                                          f"{fold_name} ({a}-{b}) is a side of {len(bodies)} bodies, expected 2",
+                                          fold=fold_name, vertices=[a, b], bodies=bodies))
+        elif len(bodies) > 2:
+            diagnostics.append(diagnostic(WARNING, "overshared_fold",
+                                          f"{fold_name} ({a}-{b}) is a side of {len(bodies)} bodies, expected 2",
+                                          fold=fold_name, vertices=[a, b], bodies=bodies))
+    return diagnostics
+
+
+def collect_edges(data, index, sides_of_bodies):
+    ''' All distinct edges of the design as vertex index pairs: the body sides and the folds. '''
+    edges = set()
+    for body_sides in sides_of_bodies.values():
+        for a, b in body_sides:
+            edges.add(tuple(sorted((index[a], index[b]))))
+    for _, a, b in collect_folds(data):
+        if a in index and b in index and a != b:
+            edges.add(tuple(sorted((index[a], index[b]))))
+    return sorted(edges)
+
+
+def candidate_pairs(segments, cell_size):
+    ''' Buckets segments into a uniform grid by bounding box and returns each pair of segments
+    that share a cell once. Only these pairs need an exact intersection test. '''
+    low = np.floor(np.minimum(segments[:, 0], segments[:, 1]) / cell_size).astype(int)
+    high = np.floor(np.maximum(segments[:, 0], segments[:, 1]) / cell_size).astype(int)
+    grid = {}
+    for s in range(len(segments)):
+        for cx in range(low[s, 0], high[s, 0] + 1):
+            for cy in range(low[s, 1], high[s, 1] + 1):
+                grid.setdefault((cx, cy), []).append(s)
+    pairs = set()
+    for members in grid.values():
+        if len(members) > 1:
+            pairs.update(itertools.combinations(members, 2))
+    return np.array(sorted(pairs), dtype=int).reshape(-1, 2)
+
+
+def orientation(a, b, c):
+    return (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+
+
+def check_crossings(names, points, edges, tolerance):
+    ''' Finds edges that cross, overlap, or pass through another vertex. Candidates come from a grid
+    bucketing, so the cost is roughly linear in the number of edges plus the number of hits. '''
+    diagnostics = []
+    if len(edges) < 2:
+        return diagnostics
+    edges = np.array(edges, dtype=int)
+    segments = points[edges]  # (m, 2 endpoints, 2 coordinates)
+    lengths = np.hypot(*(segments[:, 1] - segments[:, 0]).T)
+    cell_size = max(float(np.mean(lengths)), tolerance)
+    pairs = candidate_pairs(segments, cell_size)
+    if len(pairs) == 0:
+        return diagnostics
+    first, second = edges[pairs[:, 0]], edges[pairs[:, 1]]
+    shared = ((first[:, :1] == second).any(axis=1)) | ((first[:, 1:] == second).any(axis=1))
+    pairs, first, second = pairs[~shared], first[~shared], second[~shared]
+    p1, p2 = points[first[:, 0]], points[first[:, 1]]
+    q1, q2 = points[second[:, 0]], points[second[:, 1]]
+    # Orientation values are areas, so they are compared against tolerance times the edge length.
+    eps_p = tolerance * lengths[pairs[:, 0]]
+    eps_q = tolerance * lengths[pairs[:, 1]]
+    d1, d2 = orientation(q1, q2, p1), orientation(q1, q2, p2)
+    d3, d4 = orientation(p1, p2, q1), orientation(p1, p2, q2)
+    proper = (d1 * d2 < 0) & (d3 * d4 < 0) & (np.abs(d1) > eps_q) & (np.abs(d2) > eps_q) \
+        & (np.abs(d3) > eps_p) & (np.abs(d4) > eps_p)
+    collinear = (np.abs(d1) <= eps_q) & (np.abs(d2) <= eps_q)
+    # Overlap of collinear segments, measured along the first segment.
+    direction = (p2 - p1) / np.maximum(lengths[pairs[:, 0]], tolerance)[:, None]
+    t_q1 = np.sum((q1 - p1) * direction, axis=1)
+    t_q2 = np.sum((q2 - p1) * direction, axis=1)
+    overlap = np.minimum(np.maximum(t_q1, t_q2), lengths[pairs[:, 0]]) - np.maximum(np.minimum(t_q1, t_q2), 0)
+    overlapping = collinear & (overlap > tolerance)
+
+    def within(a, b, c, eps):
+        ''' c lies on segment ab, away from its endpoints. '''
+        ab = b - a
+        t = np.sum((c - a) * ab, axis=1) / np.maximum(np.sum(ab * ab, axis=1), tolerance * tolerance)
+        length = np.hypot(*ab.T)
+        margin = tolerance / np.maximum(length, tolerance)
+        return (np.abs(orientation(a, b, c)) <= eps) & (t > margin) & (t < 1 - margin)
+
+    touching = ~proper & ~overlapping & (within(q1, q2, p1, eps_q) | within(q1, q2, p2, eps_q)
+                                         | within(p1, p2, q1, eps_p) | within(p1, p2, q2, eps_p))
+
+    def edge_names(e):
+        return [names[e[0]], names[e[1]]]
+
+    for i in np.nonzero(proper | overlapping)[0]:
+        a, b = edge_names(first[i]), edge_names(second[i])
+        kind = "cross" if proper[i] else "overlap"
+        diagnostics.append(diagnostic(ERROR, "crossing_edges", f"edges {a[0]}-{a[1]} and {b[0]}-{b[1]} {kind}",
+                                      edges=[a, b]))
+    for i in np.nonzero(touching)[0]:
+        a, b = edge_names(first[i]), edge_names(second[i])
+        diagnostics.append(diagnostic(WARNING, "vertex_on_edge",
+                                      f"edges {a[0]}-{a[1]} and {b[0]}-{b[1]} touch away from a shared vertex",
+                                      edges=[a, b]))
+    return diagnostics
+
+
+def check_unused_vertices(data, names):
+    used = set(v for body_vertices in data.get("bodies", {}).values() for v in body_vertices)
+    return [diagnostic(WARNING, "unused_vertex", f"{v} is not part of any body", vertices=[v])
+            for v in names if v not in used]
+
+
+def validate_design(data, tolerance=DEFAULT_TOLERANCE):
+    ''' Checks a design dictionary (the JSON written by input_GUI.py) for problems that would otherwise
+    only show up while building bodies, compiling, or simulating. Returns a list of diagnostics;
+    the design is safe to compile when none of them has level "error". '''
+    diagnostics = check_structure(data)
+    if diagnostics:
+        return diagnostics
+    names, points = collect_vertices(data)
+    index = {name: i for i, name in enumerate(names)}
+    diagnostics = check_references(data, index)
+    if has_errors(diagnostics):
+        # The remaining checks assume every referenced vertex exists and has a position.
+        return diagnostics
+    sides = body_sides(data, names, index, points)
+    diagnostics += check_duplicate_vertices(names, points, tolerance)
+    diagnostics += check_bodies(data, names, index, points, tolerance)
+    diagnostics += check_folds(data, sides)
+    diagnostics += check_crossings(names, points, collect_edges(data, index, sides), tolerance)
+    diagnostics += check_unused_vertices(data, names)
+    return diagnostics
+
+
+if __name__ == '__main__':
+    # Validate a saved design: python validate_design.py [design.json]
+    path = sys.argv[1] if len(sys.argv) > 1 else './designs/design.json'
+    with open(path) as f:
+        data = json.load(f)
+    diagnostics = validate_design(data)
+    for d in diagnostics:
+        print(format_diagnostic(d))
+    if not diagnostics:
+        print(f"{path}: no problems found")
+    sys.exit(1 if has_errors(diagnostics) else 0)